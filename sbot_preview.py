@@ -0,0 +1,299 @@
+import json
+import html
+import threading
+import webbrowser
+import http.server
+import urllib.parse
+import sublime
+from . import sbot_common as sc
+
+
+# Live preview of rendered views served from localhost. Each previewed view is a page made of a style
+# block and a list of line fragments. Edits are pushed to the open browser page as server-sent events
+# which carry only the span of lines that changed since the version the page last saw.
+
+# The running server or None if not started.
+_server = None
+
+# Previewed views. k:view id v:_Page
+_pages = {}
+
+# Guards _pages and wakes up the event streams when something changes.
+_cond = threading.Condition()
+
+# Seconds an idle event stream waits before sending a keepalive.
+_KEEPALIVE = 15
+
+
+#-----------------------------------------------------------------------------------
+class _Page(object):
+    ''' The current render of one view. '''
+
+    def __init__(self, mode, title, head):
+        self.mode = mode  # 'html' or 'markdown'
+        self.title = title
+        self.head = head  # static markup for <head>, change forces a reload
+        self.style = ''
+        self.lines = []
+        self.version = 0
+        self.head_version = 0  # when mode or head last changed
+        self.diff = None  # update from version - 1 to version
+
+    def snapshot(self, since):
+        ''' Update that replaces everything a client at version since has. '''
+        return {'title': self.title, 'style': self.style, 'start': 0, 'remove': -1, 'insert': self.lines, 'reload': since < self.head_version}
+
+
+#-----------------------------------------------------------------------------------
+def start():
+    '''Start the server if not already running. Returns the base url or None if failed.'''
+    global _server
+
+    if _server is None:
+        settings = sublime.load_settings(sc.get_settings_fn())
+        port = int(str(settings.get('preview_port')))
+        try:
+            _server = http.server.ThreadingHTTPServer((sc.HOST, port), _Handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            sc.info(f'Preview server running at {get_url()}')
+        except Exception as e:
+            sc.error(f'Failed to start preview server on port {port}: {e}', e.__traceback__)
+            _server = None
+
+    return get_url()
+
+
+#-----------------------------------------------------------------------------------
+def stop():
+    '''Stop the server. Open pages are told to close their event streams.'''
+    global _server
+
+    with _cond:
+        _pages.clear()
+        _cond.notify_all()
+
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+#-----------------------------------------------------------------------------------
+def get_url(view_id=None):
+    '''Url of the server or of the page for view_id. None if not running.'''
+    if _server is None:
+        return None
+    host, port = _server.server_address[:2]
+    return f'http://{host}:{port}' if view_id is None else f'http://{host}:{port}/view/{view_id}'
+
+
+#-----------------------------------------------------------------------------------
+def publish(view, mode, title, style, lines, head=''):
+    '''
+    Update the preview of view and push the changes to any open page. mode is 'html' (lines are elements)
+    or 'markdown' (lines are source text). The page is opened in the browser the first time only.
+    Returns False if the server couldn't be started.
+    '''
+    if start() is None:
+        return False
+
+    vid = view.id()
+    is_new = False
+
+    with _cond:
+        page = _pages.get(vid)
+        if page is None:
+            page = _Page(mode, title, head)
+            _pages[vid] = page
+            is_new = True
+
+        # Find the changed span by trimming the common prefix and suffix. Edits are usually contiguous.
+        old = page.lines
+        nmax = min(len(old), len(lines))
+        start_line = 0
+        while start_line < nmax and old[start_line] == lines[start_line]:
+            start_line += 1
+        end = 0
+        while end < nmax - start_line and old[-1 - end] == lines[-1 - end]:
+            end += 1
+
+        page.diff = {'title': title,
+                     'style': style if style != page.style else None,
+                     'start': start_line,
+                     'remove': len(old) - start_line - end,
+                     'insert': lines[start_line:len(lines) - end],
+                     'reload': mode != page.mode or head != page.head}
+
+        page.version += 1
+        if page.diff['reload']:
+            page.head_version = page.version
+        page.mode = mode
+        page.title = title
+        page.head = head
+        page.style = style
+        page.lines = lines
+        _cond.notify_all()
+
+    if is_new:
+        webbrowser.open_new_tab(get_url(vid))
+
+    return True
+
+
+#-----------------------------------------------------------------------------------
+def remove(view_id):
+    '''Forget the preview of view_id. Its open page is told to close.'''
+    with _cond:
+        _pages.pop(view_id, None)
+        _cond.notify_all()
+
+
+#-----------------------------------------------------------------------------------
+class _Handler(http.server.BaseHTTPRequestHandler):
+    ''' Serves /view/<id> pages and /events/<id> streams. Runs in server threads so no sublime api here. '''
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+
+        if len(parts) == 2 and parts[1].isdigit():
+            if parts[0] == 'view':
+                self._send_page(int(parts[1]))
+                return
+            if parts[0] == 'events':
+                # Browser sends the last id it got when reconnecting.
+                since = self.headers.get('Last-Event-ID') or urllib.parse.parse_qs(url.query).get('version', ['-1'])[0]
+                self._send_events(int(parts[1]), int(since) if since.lstrip('-').isdigit() else -1)
+                return
+
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet.
+        pass
+
+    def _send_page(self, vid):
+        with _cond:
+            page = _pages.get(vid)
+            if page is None:
+                self.send_error(404, 'Not being previewed')
+                return
+            body = _make_page(vid, page).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, vid, since):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        page = _pages.get(vid)
+        closed = False
+
+        try:
+            while not closed:
+                with _cond:
+                    _cond.wait_for(lambda: page is None or _pages.get(vid) is not page or page.version != since, _KEEPALIVE)
+
+                    if page is None or _pages.get(vid) is not page:
+                        # Stopped or view closed.
+                        closed = True
+                        msg = 'data: {"closed": true}\n\n'
+                    elif page.version == since:
+                        msg = ': keepalive\n\n'
+                    else:
+                        update = page.diff if since == page.version - 1 else page.snapshot(since)
+                        since = page.version
+                        msg = f'id: {since}\ndata: {json.dumps(update)}\n\n'
+
+                self.wfile.write(msg.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Page went away.
+            pass
+
+
+#-----------------------------------------------------------------------------------
+def _make_page(vid, page):
+    ''' Full html for the current version of page. '''
+
+    if page.mode == 'markdown':
+        # Markdeep in script mode formats on demand from the source lines the client holds.
+        lines = json.dumps(page.lines).replace('</', '<\\/')
+        body = f'''
+        <div id="sbot_content"></div>
+        <script>
+            let lines = {lines};
+            document.getElementById('sbot_style').insertAdjacentHTML('beforebegin', window.markdeep.stylesheet());
+            function sbot_apply(d) {{
+                lines.splice(d.start, d.remove < 0 ? lines.length : d.remove, ...d.insert);
+                document.getElementById('sbot_content').innerHTML = window.markdeep.format(lines.join('\\n'), true);
+            }}
+            sbot_apply({{start: 0, remove: 0, insert: []}});
+        </script>
+'''
+    else:
+        # Each line is an element of the content pane.
+        content = ''.join(f'            {line}\n' for line in page.lines)
+        body = f'''
+        <div class="container">
+        <div class="contentpane" id="sbot_content">
+{content}
+        </div>
+        </div>
+        <script>
+            function sbot_apply(d) {{
+                const pane = document.getElementById('sbot_content');
+                const count = d.remove < 0 ? pane.children.length : d.remove;
+                for (let i = 0; i < count; i++) {{
+                    pane.children[d.start].remove();
+                }}
+                const tmp = document.createElement('template');
+                tmp.innerHTML = d.insert.join('');
+                pane.insertBefore(tmp.content, pane.children[d.start] || null);
+            }}
+        </script>
+'''
+
+    return f'''
+<!doctype html>
+<html lang="en">
+    <head>
+        <title>{html.escape(page.title)}</title>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+{page.head}
+        <style type="text/css" id="sbot_style">
+{page.style}
+        </style>
+    </head>
+    <body>
+{body}
+        <script>
+            const source = new EventSource('/events/{vid}?version={page.version}');
+            source.onmessage = function(ev) {{
+                const d = JSON.parse(ev.data);
+                if (d.closed) {{
+                    source.close();
+                    document.title = '[closed] ' + document.title;
+                }} else if (d.reload) {{
+                    location.reload();
+                }} else {{
+                    document.title = d.title;
+                    if (d.style !== null) {{
+                        document.getElementById('sbot_style').textContent = d.style;
+                    }}
+                    sbot_apply(d);
+                }}
+            }};
+        </script>
+    </body>
+</html>
+'''
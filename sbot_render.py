@@ -4,9 +4,32 @@ import math
 import webbrowser
 import html
 import shutil
+import json
+import time
+import hashlib
 import sublime
 import sublime_plugin
 from . import sbot_common as sc
+from . import sbot_preview as sp
+
+
+# Views being live previewed. k:view id v:(command, args)
+_previews = {}
+
+# Outstanding modification debounces. k:view id v:count
+_pending = {}
+
+# Rendered rows of html previews so edits only render what changed. k:view id v:_HtmlPreview
+_html_previews = {}
+
+# Highlights registered by other plugins, persisted in the store. k:region_name v:HighlightInfo. Loaded on first use.
+_registered_hl = None
+
+# Render output cache index, oldest first. k:key v:size. Loaded on first use.
+_cache = None
+
+# Cache keys use view id and change_count which restart with ST so also need this run.
+_session = time.time()
 
 
 #-----------------------------------------------------------------------------------
@@ -18,7 +41,7 @@ def plugin_loaded():
 #-----------------------------------------------------------------------------------
 def plugin_unloaded():
     ''' Called per plugin instance. '''
-    pass
+    sp.stop()
 
 
 #-----------------------------------------------------------------------------------
@@ -29,6 +52,50 @@ class RenderEvent(sublime_plugin.EventListener):
         # First thing that happens when plugin/window created. Initialize everything.
         del views
 
+    def on_modified(self, view):
+        # Debounce edits to previewed views then render again.
+        vid = view.id()
+        if vid in _previews:
+            settings = sublime.load_settings(sc.get_settings_fn())
+            _pending[vid] = _pending.get(vid, 0) + 1
+            sublime.set_timeout(lambda: self._preview_update(view), int(str(settings.get('preview_delay'))))
+
+    def on_close(self, view):
+        _stop_preview(view.id())
+
+    def _preview_update(self, view):
+        ''' Runs in main thread. Only the last of a burst of edits does the work. '''
+        vid = view.id()
+        _pending[vid] = _pending.get(vid, 1) - 1
+        if _pending[vid] <= 0 and vid in _previews and view.is_valid():
+            cmd, args = _previews[vid]
+            view.run_command(cmd, args)
+
+
+#-----------------------------------------------------------------------------------
+class SbotRenderPreviewStopCommand(sublime_plugin.WindowCommand):
+    ''' Stop the live preview server. '''
+
+    def is_enabled(self):
+        return len(_previews) > 0
+
+    def run(self):
+        _previews.clear()
+        _pending.clear()
+        _html_previews.clear()
+        sp.stop()
+
+
+#-----------------------------------------------------------------------------------
+class _HtmlPreview(object):
+    ''' What was last published for an html preview. One entry per row in the lists. '''
+
+    def __init__(self):
+        self.all_styles = {}  # k:style v:id, kept so ids don't change between updates
+        self.texts = []  # row text
+        self.scopes = []  # scope at row start
+        self.bodies = []  # row html
+
 
 #-----------------------------------------------------------------------------------
 class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
@@ -37,8 +104,9 @@ class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
     _rows = 0
     _row_num = 0
     _line_numbers = False
+    _cache_key = None
 
-    def run(self, edit, line_numbers=False):
+    def run(self, edit, line_numbers=False, preview=False, incremental=False):
         del edit
         self._line_numbers = line_numbers
         settings = sublime.load_settings(sc.get_settings_fn())
@@ -46,7 +114,19 @@ class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
         max_file = int(str(settings.get('max_file')))
         fsize = self.view.size() / 1024 / 1024
         if fsize > max_file:
+            # Don't keep nagging on every edit.
+            _stop_preview(self.view.id())
             sublime.message_dialog('File too large to render. If you really want to, change your settings')
+            return
+
+        if preview:
+            self._do_preview(incremental)
+            return
+
+        # Maybe nothing changed since the last time.
+        self._cache_key = _get_cache_key(self.view, 'html', line_numbers)
+        if _open_cached(self.view.file_name(), self._cache_key):
+            self.view.set_status('render', 'Render done (cached)')
         else:
             self._do_render()
             # Actually would like to run in a thread but takes 10x time, probably the GIL.
@@ -77,16 +157,119 @@ class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
 
         # Get prefs.
         settings = sublime.load_settings(sc.get_settings_fn())
-        html_background = settings.get('html_background')
 
         # Collect scope/style info. Styles will be turned into html styles.
         all_styles = {}  # k:style v:id
-        region_styles = []  # One [(Region, style)] per line
-        highlight_regions = []  # (Region, style))
 
         self._rows, _ = self.view.rowcol(self.view.size())
         self._row_num = 0
 
+        # Start progress.
+        sublime.set_timeout(self._update_status, 100)
+
+        # Tokenize selection by syntax scope.
+        line_regions = []
+        for region in sc.get_sel_regions(self.view):
+            line_regions.extend(self.view.split_by_newlines(region))
+        bodies = self._render_lines(line_regions, all_styles, settings)
+
+        # Done all lines.
+        style_text = _make_style(all_styles, len(bodies), settings)
+        lines = _make_lines(bodies, self._line_numbers)
+
+        # Give it a name.
+        name = _get_name(self.view)
+
+        # Output html.
+        html1 = f'''
+<!doctype html>
+<html lang="en">
+    <head>
+        <title>{name}</title>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <style  type="text/css">
+'''
+
+        html2 = '''
+        </style>
+    </head>
+    <body>
+        <div class="container">
+        <div class="contentpane">
+'''
+
+        html3 = '''
+        </div>
+        </div>
+    </body>
+</html>
+'''
+        content = ''.join(f'            {line}\n' for line in lines)
+        _gen_html(self.view.file_name(), [html1, style_text, html2, content, html3], self._cache_key)
+
+    def _do_preview(self, incremental):
+        '''
+        Render the whole view for the live preview. Updates only render the rows whose text changed since
+        the last publish plus any following rows that now tokenize differently, e.g. after opening a comment.
+        '''
+        settings = sublime.load_settings(sc.get_settings_fn())
+        vid = self.view.id()
+
+        # No point rendering if there's nowhere to show it. Start failure has already told the user.
+        if sp.start() is None:
+            _stop_preview(vid)
+            return
+
+        texts = self.view.substr(sublime.Region(0, self.view.size())).split('\n')
+        starts = []  # row start points
+        point = 0
+        for text in texts:
+            starts.append(point)
+            point += len(text) + 1
+
+        state = _html_previews.get(vid) if incremental else None
+
+        if state is None:
+            # Everything.
+            state = _HtmlPreview()
+            _html_previews[vid] = state
+            first, old_end, new_end = 0, 0, len(texts)
+        else:
+            # Trim the rows that didn't change.
+            old = state.texts
+            nmax = min(len(old), len(texts))
+            first = 0
+            while first < nmax and old[first] == texts[first]:
+                first += 1
+            end = 0
+            while end < nmax - first and old[-1 - end] == texts[-1 - end]:
+                end += 1
+            old_end = len(old) - end
+            new_end = len(texts) - end
+
+            # Carry on until a row starts in the same scope as before.
+            while new_end < len(texts) and self.view.scope_name(starts[new_end]) != state.scopes[old_end]:
+                new_end += 1
+                old_end += 1
+
+        line_regions = [sublime.Region(starts[row], starts[row] + len(texts[row])) for row in range(first, new_end)]
+        state.bodies[first:old_end] = self._render_lines(line_regions, state.all_styles, settings)
+        state.scopes[first:old_end] = [self.view.scope_name(region.a) for region in line_regions]
+        state.texts = texts
+
+        # Line numbers are css counters so rows don't change when others are added or removed.
+        if sp.publish(self.view, 'html', _get_name(self.view), _make_style(state.all_styles, len(state.bodies), settings, self._line_numbers),
+                      _make_lines(state.bodies, False)):
+            _previews[vid] = ('sbot_render_to_html', {'line_numbers': self._line_numbers, 'preview': True, 'incremental': True})
+        else:
+            _stop_preview(vid)
+
+    def _render_lines(self, line_regions, all_styles, settings):
+        ''' Tokenize line_regions by syntax scope and highlights. New styles are added to all_styles. Returns html per line. '''
+
+        region_styles = []  # One [(Region, style)] per line
+
         # Local helpers.
         def _add_style(style):
             # Add style to our collection.
@@ -105,123 +288,83 @@ class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
                   view_style.get('underline', False))
             return tt
 
-        # Start progress.
-        sublime.set_timeout(self._update_status, 100)
+        # If there are Highlight Token highlights in the lines, collect them.
+        highlight_regions = _get_highlight_regions(self.view, line_regions, settings)  # [(Region, style)]
+        hl_index = 0  # next one
 
-        # If there are Highlight Token highlights, collect them.
-        hl_info = sc.get_highlight_info('all')
+        # pc = SbotPerfCounter('render_html')
+        for line_region in line_regions:
+            # pc.start()
+            self._row_num += 1
 
-        for hl in hl_info:
-            ss = self.view.style_for_scope(hl.scope_name)
-            background = ss['background'] if 'background' in ss else None
-            foreground = ss['foreground'] if 'foreground' in ss else None
-            hl_style = (foreground, background, False, False, False)
-            _add_style(hl_style)
+            line_styles = []  # (Region, style))
 
-            # Assign style to the highlight regions.
-            for region in self.view.get_regions(hl.region_name):
-                highlight_regions.append((region, hl_style))
+            # Start a new line.
+            current_style = None
+            current_style_start = line_region.a  # current chunk
 
-        # Put all regions in order.
-        highlight_regions.sort(key=lambda r: r[0].a)
+            # Process the individual line chars.
+            point = line_region.a
 
-        # Tokenize selection by syntax scope.
-        # pc = SbotPerfCounter('render_html')
-        settings = sublime.load_settings(sc.get_settings_fn())
-        for region in sc.get_sel_regions(self.view):
-            for line_region in self.view.split_by_newlines(region):
-                # pc.start()
-                self._row_num += 1
+            while point < line_region.b:
+                # Skip highlights already covered by an overlapping one.
+                while hl_index < len(highlight_regions) and highlight_regions[hl_index][0].b <= point:
+                    hl_index += 1
 
-                line_styles = []  # (Region, style))
+                # Check if it's a highlight first as they take precedence.
+                if hl_index < len(highlight_regions) and point >= highlight_regions[hl_index][0].a:
+                    # Start a highlight. Never go back over what's done.
+                    hl_region, new_style = highlight_regions[hl_index]
+                    hl_region = sublime.Region(point, hl_region.b)
 
-                # Start a new line.
-                current_style = None
-                current_style_start = line_region.a  # current chunk
+                    # Save last maybe.
+                    if point > current_style_start:
+                        line_styles.append((sublime.Region(current_style_start, point), current_style))
 
-                # Process the individual line chars.
-                point = line_region.a
+                    # Save highlight info.
+                    line_styles.append((hl_region, new_style))
 
-                while point < line_region.b:
-                    # Check if it's a highlight first as they take precedence.
-                    if len(highlight_regions) > 0 and point >= highlight_regions[0][0].a:
-                        # Start a highlight.
-                        new_style = highlight_regions[0][1]
+                    _add_style(new_style)
 
-                        # Save last maybe.
-                        if point > current_style_start:
-                            line_styles.append((sublime.Region(current_style_start, point), current_style))
+                    # Bump ahead.
+                    point = hl_region.b
+                    current_style = new_style
+                    current_style_start = point
 
-                        # Save highlight info.
-                        line_styles.append((highlight_regions[0][0], new_style))
+                    # Done with this one.
+                    hl_index += 1
+                else:
+                    # Plain ordinary style. Did it change?
+                    new_style = _view_style_to_tuple(self.view.style_for_scope(self.view.scope_name(point)))
 
-                        _add_style(new_style)
+                    if new_style != current_style:
+                        # Save last chunk maybe.
+                        if point > current_style_start:
+                            line_styles.append((sublime.Region(current_style_start, point), current_style))
 
-                        # Bump ahead.
-                        point = highlight_regions[0][0].b
                         current_style = new_style
                         current_style_start = point
 
-                        # Remove from the list.
-                        del highlight_regions[0]
-                    else:
-                        # Plain ordinary style. Did it change?
-                        new_style = _view_style_to_tuple(self.view.style_for_scope(self.view.scope_name(point)))
-
-                        if new_style != current_style:
-                            # Save last chunk maybe.
-                            if point > current_style_start:
-                                line_styles.append((sublime.Region(current_style_start, point), current_style))
-
-                            current_style = new_style
-                            current_style_start = point
-
-                            _add_style(new_style)
-
-                        # Bump ahead.
-                        point += 1
+                        _add_style(new_style)
 
-                # Done with this line. Save last chunk maybe.
-                if point > current_style_start:
-                    line_styles.append((sublime.Region(current_style_start, point), current_style))
+                    # Bump ahead.
+                    point += 1
 
-                # Add to master list.
-                region_styles.append(line_styles)
-                # pc.stop()
+            # Done with this line. Save last chunk maybe.
+            if point > current_style_start:
+                line_styles.append((sublime.Region(current_style_start, point), current_style))
 
-        # Done all lines.
-
-        # Create css.
-        style_text = ""
-        for style, stid in all_styles.items():
-            props = f'{{ color:{style[0]}; '
-            if style[1] is not None:
-                props += f'background-color:{style[1]}; '
-            if style[2]:
-                props += 'font-weight:bold; '
-            if style[3]:
-                props += 'font-style:italic; '
-            if style[4]:
-                props += 'text-decoration:underline; '
-            props += '}'
-            style_text += f'            .st{stid} {props}\n'
+            # Add to master list.
+            region_styles.append(line_styles)
+            # pc.stop()
 
         # Content text.
-        content = []
-        line_num = 1
-
-        # Iterate collected lines.
-        gutter_size = math.ceil(math.log(len(region_styles), 10))
-        padding1 = 1.4 + gutter_size * 0.5
-        padding2 = padding1
-
+        bodies = []
         for line_styles in region_styles:
-            # Start line.
-            content.append(f'            <p>{line_num:0{gutter_size}} ' if self._line_numbers else f'            <p>')
-
             if len(line_styles) == 0:
-                content.append('<br>')
+                bodies.append('<br>')
             else:
+                content = []
                 for region, style in line_styles:
                     #[(Region, style(ref))]
                     text = self.view.substr(region)
@@ -229,50 +372,9 @@ class SbotRenderToHtmlCommand(sublime_plugin.TextCommand):
                     # Locate the style.
                     stid = _get_style(style)
                     content.append(f'<span class=st{stid}>{html.escape(text)}</span>' if stid >= 0 else text)
+                bodies.append(''.join(content))
 
-            # Done line.
-            content.append('</p>\n')
-            line_num += 1
-
-        # Give it a name.
-        name = self.view.name()
-        if (name is None or name == '') and self.view.file_name() is not None:
-            # name = os.path.basename(os.path.splitext(self.view.file_name())[0])
-            name = str(self.view.file_name())
-            parts = os.path.splitext(name)
-            name = parts[0]
-
-        if (name is None or name == ''):
-            name = 'temp'
-
-        # Output html.
-        html1 = f'''
-<!doctype html>
-<html lang="en">
-    <head>
-        <title>{name}</title>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style  type="text/css">
-            .contentpane {{ font-family: {settings.get('html_font_face')}; font-size: {settings.get('html_font_size')}; background-color: {html_background}; text-indent: -{padding1}em; padding-left: {padding2}em; }}
-            p {{ white-space: pre-wrap; margin: 0em; }}
-'''
-
-        html2 = '''
-        </style>
-    </head>
-    <body>
-        <div class="container">
-        <div class="contentpane">
-'''
-
-        html3 = '''
-        </div>
-        </div>
-    </body>
-</html>
-'''
-        _gen_html(self.view.file_name(), [html1, style_text, html2, ''.join(content), html3])
+        return bodies
 
 
 #-----------------------------------------------------------------------------------
@@ -282,12 +384,21 @@ class SbotRenderMarkdownCommand(sublime_plugin.TextCommand):
     def is_visible(self):
         return self.view.settings().get('syntax') == 'Packages/Markdown/Markdown.sublime-syntax'
 
-    def run(self, edit):
+    def run(self, edit, preview=False):
         del edit
         # Get prefs.
         settings = sublime.load_settings(sc.get_settings_fn())
         output_dir = str(settings.get('output_dir'))
 
+        if preview:
+            self._do_preview(settings)
+            return
+
+        # Maybe nothing changed since the last time.
+        cache_key = _get_cache_key(self.view, 'markdown', None)
+        if _open_cached(self.view.file_name(), cache_key):
+            return
+
         html = []
 
         # Build it.
@@ -316,21 +427,294 @@ class SbotRenderMarkdownCommand(sublime_plugin.TextCommand):
         html.append('<script>window.alreadyProcessedMarkdeep||(document.body.style.visibility="visible")</script>')
 
         if html is not None:
-            _gen_html(self.view.file_name(), html)
+            _gen_html(self.view.file_name(), html, cache_key)
+
+    def _do_preview(self, settings):
+        ''' Send the source lines to the preview server, markdeep formats them in the page. '''
+        # Always the whole view as edits collapse the selection.
+        lines = self.view.substr(sublime.Region(0, self.view.size())).split('\n')
+
+        # User css is inlined as there is no output dir to copy it to.
+        style = ''
+        md_css = settings.get('md_css')
+        if md_css is not None and len(md_css) > 0:
+            if os.path.exists(md_css):
+                with open(md_css, 'r', encoding='utf-8') as f:
+                    style = f.read()
+            else:
+                # Don't nag on every edit.
+                sc.info(f'Invalid css file [{md_css}]')
+
+        toc = 'long' if settings.get('md_toc') else 'none'
+        head = f'''        <script>markdeepOptions={{mode:"script", tocStyle:"{toc}"}};</script>
+        <script src="https://casual-effects.com/markdeep/latest/markdeep.min.js?" charset="utf-8"></script>
+'''
+
+        if sp.publish(self.view, 'markdown', _get_name(self.view), style, lines, head):
+            _previews[self.view.id()] = ('sbot_render_markdown', {'preview': True})
+        else:
+            # Don't retry and nag on every edit.
+            _stop_preview(self.view.id())
+
+
+#-----------------------------------------------------------------------------------
+def _stop_preview(view_id):
+    ''' Stop live previewing view_id if it is. '''
+    _html_previews.pop(view_id, None)
+    _pending.pop(view_id, None)
+    if _previews.pop(view_id, None) is not None:
+        sp.remove(view_id)
+
+
+#-----------------------------------------------------------------------------------
+def _make_style(all_styles, num_lines, settings, line_counter=False):
+    ''' Css for the rendered html. line_counter adds line numbers with css instead of in the text. '''
+
+    # Gutter for line numbers.
+    gutter_size = math.ceil(math.log(num_lines, 10)) if num_lines > 0 else 0
+    padding1 = 1.4 + gutter_size * 0.5
+    padding2 = padding1
+
+    style_text = f'''            .contentpane {{ font-family: {settings.get('html_font_face')}; font-size: {settings.get('html_font_size')}; background-color: {settings.get('html_background')}; text-indent: -{padding1}em; padding-left: {padding2}em; }}
+            p {{ white-space: pre-wrap; margin: 0em; }}
+'''
+    if line_counter:
+        style_text += f'''            .contentpane {{ counter-reset: line; }}
+            p {{ counter-increment: line; }}
+            p::before {{ content: counter(line); display: inline-block; min-width: {gutter_size}ch; padding-right: 1ch; text-align: right; user-select: none; }}
+'''
+
+    for style, stid in all_styles.items():
+        props = f'{{ color:{style[0]}; '
+        if style[1] is not None:
+            props += f'background-color:{style[1]}; '
+        if style[2]:
+            props += 'font-weight:bold; '
+        if style[3]:
+            props += 'font-style:italic; '
+        if style[4]:
+            props += 'text-decoration:underline; '
+        props += '}'
+        style_text += f'            .st{stid} {props}\n'
+
+    return style_text
+
+
+#-----------------------------------------------------------------------------------
+def _make_lines(bodies, line_numbers):
+    ''' One <p> per line from the rendered line bodies. '''
+    gutter_size = math.ceil(math.log(len(bodies), 10)) if len(bodies) > 0 else 0
+    if line_numbers:
+        return [f'<p>{line_num:0{gutter_size}} {body}</p>' for line_num, body in enumerate(bodies, 1)]
+    return [f'<p>{body}</p>' for body in bodies]
 
 
 #-----------------------------------------------------------------------------------
-def _gen_html(fn, content):
-    ''' Common html file output generator. '''
+class SbotRenderRegisterHighlightCommand(sublime_plugin.ApplicationCommand):
+    '''
+    Lets other plugins add their highlight scopes to the render, e.g.:
+    sublime.run_command('sbot_render_register_highlight', {'scope_name': 'markup.notr_hl1', 'region_name': 'region_notr_hl1'})
+    Registrations are kept in the store so they survive reloads. The command doesn't exist until this plugin
+    is loaded and run_command() silently ignores unknown commands, so callers should register lazily
+    (e.g. via sublime.set_timeout() from their plugin_loaded()) rather than directly in plugin_loaded().
+    Registering an existing region_name, including a builtin one, replaces it.
+    '''
+
+    def run(self, scope_name, region_name, hl_type='user'):
+        _load_registered_hl()[region_name] = sc.HighlightInfo(scope_name, region_name, hl_type)
+        _save_registered_hl()
+
+
+#-----------------------------------------------------------------------------------
+class SbotRenderUnregisterHighlightCommand(sublime_plugin.ApplicationCommand):
+    '''
+    Remove a registered highlight, e.g.:
+    sublime.run_command('sbot_render_unregister_highlight', {'region_name': 'region_notr_hl1'})
+    No region_name clears them all.
+    '''
+
+    def run(self, region_name=None):
+        registered = _load_registered_hl()
+        if region_name is None:
+            registered.clear()
+        else:
+            registered.pop(region_name, None)
+        _save_registered_hl()
+
+
+#-----------------------------------------------------------------------------------
+def _load_registered_hl():
+    ''' Registered highlights from the store. '''
+    global _registered_hl
+
+    if _registered_hl is None:
+        _registered_hl = {}
+        for entry in _load_store().get('highlights', []):
+            if _is_valid_hl(entry, 3):
+                _registered_hl[entry[1]] = sc.HighlightInfo(*entry)
+
+    return _registered_hl
+
+
+#-----------------------------------------------------------------------------------
+def _save_registered_hl():
+    ''' Registered highlights to the store. '''
+    store = _load_store()
+    store['highlights'] = [list(hl) for hl in _load_registered_hl().values()]
+    _save_store(store)
+
+
+#-----------------------------------------------------------------------------------
+def _is_valid_hl(entry, size):
+    ''' Check a highlight entry from json is a list of size strings. '''
+    return isinstance(entry, list) and len(entry) == size and all(isinstance(e, str) for e in entry)
+
+
+#-----------------------------------------------------------------------------------
+def _get_highlight_info(settings):
+    '''
+    Builtin, registered and settings highlights as list of HighlightInfo. One per region_name so regions
+    aren't collected twice, later ones replace earlier.
+    '''
+    hl_info = {}  # k:region_name v:HighlightInfo
+    for hl in sc.get_highlight_info('all'):
+        hl_info[hl.region_name] = hl
+    hl_info.update(_load_registered_hl())
+
+    for entry in settings.get('highlights') or []:
+        if _is_valid_hl(entry, 2):
+            hl_info[entry[1]] = sc.HighlightInfo(entry[0], entry[1], 'user')
+        else:
+            # Don't nag on every render.
+            sc.info(f'Invalid highlights setting {entry} - should be [scope_name, region_name]')
+
+    return list(hl_info.values())
+
+
+#-----------------------------------------------------------------------------------
+def _load_store():
+    ''' Contents of the plugin store. Empty if there isn't one yet or it's unreadable. '''
+    try:
+        with open(sc.get_store_fn(), 'r') as f:
+            store = json.load(f)
+            return store if isinstance(store, dict) else {}
+    except Exception:
+        return {}
+
+
+#-----------------------------------------------------------------------------------
+def _save_store(store):
+    ''' Write the plugin store. Returns False if it failed. '''
+    try:
+        with open(sc.get_store_fn(), 'w') as f:
+            json.dump(store, f, indent=4)
+        return True
+    except OSError as e:
+        sc.info(f'Failed to write store {sc.get_store_fn()}: {e}')
+        return False
+
+
+#-----------------------------------------------------------------------------------
+def _get_highlight_regions(view, sel_regions, settings):
+    '''
+    Collect highlights as [(Region, style)] clipped to sel_regions and in order. Kinds with no regions
+    cost one get_regions() and the style lookups are only done for highlights actually rendered.
+    '''
+    found = []  # (Region, scope_name)
+    for hl in _get_highlight_info(settings):
+        for region in view.get_regions(hl.region_name):
+            found.append((region, hl.scope_name))
+
+    if len(found) == 0:
+        return []
+
+    found.sort(key=lambda r: r[0].begin())
+
+    # Both lists are in order so sweep them, keeping only the highlights still open. Long ones then
+    # don't cause rescans of everything after them.
+    hl_styles = {}  # k:scope_name v:style
+    highlight_regions = []
+    active = []  # (Region, scope_name) in begin order
+    next_found = 0
+    for sel in sel_regions:
+        # Open the ones that start before the end of this selection.
+        while next_found < len(found) and found[next_found][0].begin() < sel.end():
+            active.append(found[next_found])
+            next_found += 1
+
+        # Close the ones that ended.
+        active = [hl for hl in active if hl[0].end() > sel.begin()]
+
+        for region, scope_name in active:
+            clipped = region.intersection(sel)
+            if clipped.empty():
+                continue
+
+            if scope_name not in hl_styles:
+                ss = view.style_for_scope(scope_name)
+                hl_styles[scope_name] = (ss.get('foreground', None), ss.get('background', None), False, False, False)
+
+            highlight_regions.append((clipped, hl_styles[scope_name]))
+
+    return highlight_regions
+
+
+#-----------------------------------------------------------------------------------
+def _get_name(view):
+    ''' Title for the rendered page. '''
+    name = view.name()
+    if (name is None or name == '') and view.file_name() is not None:
+        # name = os.path.basename(os.path.splitext(view.file_name())[0])
+        name = str(view.file_name())
+        parts = os.path.splitext(name)
+        name = parts[0]
+
+    if (name is None or name == ''):
+        name = 'temp'
+
+    return name
+
+
+#-----------------------------------------------------------------------------------
+def _gen_html(fn, content, cache_key=None):
+    ''' Common html file output generator. Content is added to the render cache if cache_key is given. '''
 
     def _save_file(new_fn):
         if new_fn is not None:
             with open(new_fn, 'w', encoding='utf-8') as f:  # need to explicitly set encoding because default windows is ascii
                 f.write(s)
+            _cache_put(cache_key, new_fn)
             webbrowser.open_new_tab(new_fn)
 
     s = "========== NO CONTENT ==========" if content is None else ''.join(content)
 
+    _save_output(fn, _save_file)
+
+
+#-----------------------------------------------------------------------------------
+def _open_cached(fn, cache_key):
+    ''' If cache_key has a cached render copy it to the output and open it. Returns True if it did. '''
+
+    def _save_file(new_fn):
+        if new_fn is not None:
+            try:
+                shutil.copyfile(cache_fn, new_fn)
+                webbrowser.open_new_tab(new_fn)
+            except OSError as e:
+                sc.error(f'Failed to copy cached {cache_fn} to {new_fn}: {e}', e.__traceback__)
+
+    cache_fn = _cache_get(cache_key)
+    if cache_fn is None:
+        return False
+
+    _save_output(fn, _save_file)
+    return True
+
+
+#-----------------------------------------------------------------------------------
+def _save_output(fn, save_file):
+    ''' Pick the output file name for fn and hand it to save_file(). '''
+
     settings = sublime.load_settings(sc.get_settings_fn())
     output_dir = str(settings.get('output_dir'))
     # No file name if from temp view.
@@ -338,10 +722,146 @@ def _gen_html(fn, content):
 
     if output_dir is None:
         # Make default and ask user for specifics.
-        sublime.save_dialog(_save_file, directory=os.path.dirname(fn), name=save_fn)
+        sublime.save_dialog(save_file, directory=os.path.dirname(fn), name=save_fn)
     else:
         # Use settings value.
         if os.path.isdir(output_dir):
-            _save_file(os.path.join(output_dir, save_fn))
+            save_file(os.path.join(output_dir, save_fn))
         else:
             sublime.message_dialog(f'Invalid setting for output_dir: {output_dir}. Supply valid path')
+
+
+#-----------------------------------------------------------------------------------
+def _get_cache_key(view, kind, args):
+    '''
+    Identify a render of view so it can be reused. Covers the text, selection, syntax, color scheme, highlights
+    and the settings that affect output. Returns None if it can't or shouldn't be cached.
+    The text is identified by change_count which restarts when ST does, so hits are only within a run and
+    older entries just age out.
+    '''
+    settings = sublime.load_settings(sc.get_settings_fn())
+    fn = view.file_name()
+    if fn is None or int(str(settings.get('cache_size'))) <= 0:
+        return None
+
+    md_css = settings.get('md_css')
+
+    parts = {
+        'kind': kind,
+        'fn': fn,
+        'name': view.name(),
+        'text': [_session, view.id(), view.change_count()],
+        'args': args,
+        'sel': [[r.a, r.b] for r in sc.get_sel_regions(view)],
+        'syntax': view.settings().get('syntax'),
+        'color_scheme': view.settings().get('color_scheme'),
+        'color_scheme_files': _get_resource_mtimes(view.settings().get('color_scheme')),
+        'settings': [settings.get(name) for name in ('html_font_face', 'html_font_size', 'html_background', 'md_css', 'md_toc', 'output_dir')],
+        'md_css': os.path.getmtime(md_css) if isinstance(md_css, str) and os.path.isfile(md_css) else None,
+    }
+
+    if kind == 'html':
+        # Highlights don't bump change_count.
+        parts['highlights'] = [[hl.scope_name, [[r.a, r.b] for r in view.get_regions(hl.region_name)]] for hl in _get_highlight_info(settings)]
+
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+#-----------------------------------------------------------------------------------
+def _get_resource_mtimes(name):
+    ''' Mtimes of the loose files for resource name, e.g. a color scheme and its user overrides. Packed ones are skipped. '''
+    mtimes = []
+    if isinstance(name, str) and len(name) > 0:
+        root = os.path.dirname(sublime.packages_path())
+        for res in sublime.find_resources(os.path.basename(name)):
+            path = os.path.join(root, *res.split('/'))
+            if os.path.isfile(path):
+                mtimes.append([res, os.path.getmtime(path)])
+    return mtimes
+
+
+#-----------------------------------------------------------------------------------
+def _get_cache_fn(cache_key):
+    ''' Where the cached render lives. '''
+    return os.path.join(os.path.dirname(sc.get_store_fn()), 'cache', f'{cache_key}.html')
+
+
+#-----------------------------------------------------------------------------------
+def _load_cache():
+    ''' The cache index from the store. '''
+    global _cache
+
+    if _cache is None:
+        _cache = _load_store().get('cache', {})
+        if not isinstance(_cache, dict):
+            # Unreadable - start over.
+            _cache = {}
+
+    return _cache
+
+
+#-----------------------------------------------------------------------------------
+def _save_cache():
+    ''' Write the cache index to the store, leaving the rest of it alone. '''
+    store = _load_store()
+    store['cache'] = _cache
+    _save_store(store)
+
+
+#-----------------------------------------------------------------------------------
+def _cache_get(cache_key):
+    ''' Cached render file for cache_key or None. Marks it as recently used. '''
+    if cache_key is None:
+        return None
+
+    cache = _load_cache()
+    if cache_key not in cache:
+        return None
+
+    cache_fn = _get_cache_fn(cache_key)
+    if not os.path.exists(cache_fn):
+        # Someone cleaned up.
+        del cache[cache_key]
+        _save_cache()
+        return None
+
+    # Move to most recent if not already.
+    if list(cache.keys())[-1] != cache_key:
+        cache[cache_key] = cache.pop(cache_key)
+        _save_cache()
+
+    return cache_fn
+
+
+#-----------------------------------------------------------------------------------
+def _cache_put(cache_key, fn):
+    ''' Copy the render in fn to the cache then evict least recently used until under cache_size. '''
+    if cache_key is None:
+        return
+
+    settings = sublime.load_settings(sc.get_settings_fn())
+    max_size = int(str(settings.get('cache_size'))) * 1024 * 1024
+
+    cache = _load_cache()
+    cache_fn = _get_cache_fn(cache_key)
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        shutil.copyfile(fn, cache_fn)
+    except OSError as e:
+        sc.error(f'Failed to cache {fn}: {e}', e.__traceback__)
+        return
+
+    cache.pop(cache_key, None)
+    cache[cache_key] = os.path.getsize(cache_fn)
+
+    total = sum(cache.values())
+    for old_key in list(cache.keys()):
+        if total <= max_size:
+            break
+        total -= cache.pop(old_key)
+        try:
+            os.remove(_get_cache_fn(old_key))
+        except OSError:
+            pass
+
+    _save_cache()